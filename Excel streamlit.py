@@ -1,37 +1,150 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple
 import traceback
 
-def load_excel_file(uploaded_file) -> Optional[pd.DataFrame]:
+def _upload_bytes(uploaded_file) -> bytes:
     """
-    Load an Excel file and return a DataFrame.
-    Supports both .xlsx and .xls formats.
+    Return an upload's raw bytes, rewinding the buffer first.
+
+    Streamlit reuses the same UploadedFile buffer across reruns, so after
+    any direct read the cursor sits at EOF and a naive re-read returns
+    empty bytes. Always seek(0) before taking the contents.
     """
     try:
-        if uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file, engine='openpyxl')
-        elif uploaded_file.name.endswith('.xls'):
-            df = pd.read_excel(uploaded_file, engine='xlrd')
-        else:
-            st.error("Unsupported file format. Please upload .xlsx or .xls files only.")
-            return None
-        return df
+        uploaded_file.seek(0)
+    except Exception:
+        pass
+    return uploaded_file.getvalue()
+
+def _mangle_columns(header) -> list:
+    """
+    Replicate pandas' read_excel header handling for raw header rows:
+    empty cells become 'Unnamed: <pos>' and repeated labels get '.1',
+    '.2', ... suffixes. Downstream code (the fill step in particular) is
+    written against unique column labels, so loaders that hand us the
+    header row verbatim must apply the same mangling.
+    """
+    names = []
+    counts = {}
+    for i, name in enumerate(header):
+        if name is None or name == '':
+            name = 'Unnamed: %d' % i
+        seen = counts.get(name, 0)
+        counts[name] = seen + 1
+        if seen:
+            candidate = '%s.%d' % (name, seen)
+            while candidate in counts:
+                seen += 1
+                candidate = '%s.%d' % (name, seen)
+            counts[name] = seen + 1
+            counts[candidate] = 1
+            name = candidate
+        names.append(name)
+    return names
+
+def _read_xlsx_readonly(uploaded_file) -> pd.DataFrame:
+    """
+    Read an .xlsx file with openpyxl in read_only mode.
+
+    Streams rows instead of building a full in-memory workbook with
+    styles and formulas, keeping memory roughly proportional to the file
+    size. Used as the fallback when calamine is unavailable.
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        columns = next(rows, None)
+        if columns is None:
+            return pd.DataFrame()
+        return pd.DataFrame.from_records(rows, columns=_mangle_columns(columns))
+    finally:
+        # Release the underlying ZipFile handle held by read_only mode
+        wb.close()
+
+@st.cache_data(show_spinner=False)
+def load_excel_file(file_bytes: bytes, name: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Load an Excel file and return (DataFrame, error message); exactly one
+    of the two is None. Supports both .xlsx and .xls formats.
+
+    Cached on the upload's raw bytes so Streamlit reruns (every widget
+    interaction re-executes main) don't re-parse the workbook. Errors are
+    returned rather than rendered because this runs in worker threads,
+    which have no Streamlit context to draw into; the caller shows them.
+    """
+    try:
+        if not name.endswith(('.xlsx', '.xls')):
+            return None, "Unsupported file format. Please upload .xlsx or .xls files only."
+        buf = io.BytesIO(file_bytes)
+        try:
+            # Hand the buffer straight to calamine: the Rust side parses the
+            # workbook natively and returns plain Python rows, skipping
+            # pandas' read_excel engine plumbing and its extra buffering.
+            from python_calamine import CalamineWorkbook
+
+            wb = CalamineWorkbook.from_filelike(buf)
+            rows = wb.get_sheet_by_index(0).to_python()
+            if rows:
+                df = pd.DataFrame(rows[1:], columns=_mangle_columns(rows[0]))
+                # calamine renders empty cells as '' rather than None, which
+                # would hide them from isna() and the whole fill step; map
+                # them back to NA like the pandas readers do.
+                df = df.replace('', np.nan)
+            else:
+                df = pd.DataFrame()
+        except ImportError:
+            # python-calamine not installed; fall back to the slower readers.
+            buf.seek(0)
+            if name.endswith('.xlsx'):
+                df = _read_xlsx_readonly(buf)
+            else:
+                df = pd.read_excel(buf, engine='xlrd')
+        # Narrow dtypes: the readers hand back object columns for anything
+        # mixed-looking. Nullable numeric/string arrays are much smaller
+        # and make every downstream isna/to_numpy pass cheaper.
+        return df.convert_dtypes(), None
     except Exception as e:
-        st.error(f"Error reading Excel file: {str(e)}")
-        return None
+        return None, f"Error reading Excel file: {str(e)}"
 
-def validate_file_size(uploaded_file, max_size_mb: int = 50) -> bool:
+def validate_file_size(uploaded_file, max_size_mb: int = 50,
+                       max_rows: int = 1_000_000) -> bool:
     """
     Validate file size to prevent memory issues.
+
+    For .xlsx uploads, also peek inside the zip container and estimate
+    the row count from the first worksheet's XML. This is cheap compared
+    to a parse and rejects pathological files (small on disk, millions of
+    rows) before they tie up the server for minutes.
     """
     file_size_mb = uploaded_file.size / (1024 * 1024)
     if file_size_mb > max_size_mb:
         st.error(f"File size ({file_size_mb:.1f} MB) exceeds maximum allowed size ({max_size_mb} MB)")
         return False
+    if uploaded_file.name.endswith('.xlsx'):
+        try:
+            uploaded_file.seek(0)
+            with zipfile.ZipFile(uploaded_file) as zf:
+                row_estimate = zf.read('xl/worksheets/sheet1.xml').count(b'<row ')
+        except Exception:
+            # Not inspectable here; leave error reporting to the real parser
+            row_estimate = 0
+        finally:
+            # Rewind so the actual parse doesn't see an exhausted buffer
+            uploaded_file.seek(0)
+        if row_estimate > max_rows:
+            st.error(f"File appears to contain about {row_estimate:,} rows, "
+                     f"which exceeds the maximum of {max_rows:,} rows")
+            return False
     return True
 
+@st.cache_data(show_spinner=False)
 def fill_missing_data(complete_df: pd.DataFrame, blank_df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
     """
     Fill missing data STRICTLY by position so the result has EXACTLY the same
@@ -44,69 +157,170 @@ def fill_missing_data(complete_df: pd.DataFrame, blank_df: pd.DataFrame) -> Tupl
     - Restore original index from blank_df.
     Returns the filled DataFrame and the count of cells that were filled.
     """
+    # Nothing to fill: skip the alignment/masking work entirely.
+    # ndarray.any() short-circuits on the first NA, unlike a full count.
+    if not blank_df.isna().values.any():
+        return blank_df, 0
+
     # Preserve original structure
     original_index = blank_df.index
     original_columns = blank_df.columns
     original_rows = len(blank_df)
-    original_cols = len(original_columns)
 
-    # Count missing cells before processing
-    original_missing = blank_df.isna().sum().sum()
+    # Align complete_df to blank_df's shape without reindex copies: drop
+    # each shared column's values into a preallocated NaN array at its
+    # target position, trimming extra rows. Columns missing from
+    # complete_df stay NaN and simply won't fill anything.
+    bvals = blank_df.to_numpy(copy=False)
+    cvals = np.full(bvals.shape, np.nan, dtype=object)
+    n_src_rows = min(len(complete_df), original_rows)
+    # Match columns by label, but track every position per label so
+    # duplicate names stay positional: the nth duplicate in blank_df is
+    # filled from the nth duplicate in complete_df, and if complete_df
+    # has fewer occurrences its last one covers the remaining targets
+    # (mirroring how reindex broadcasts a unique source label).
+    target_pos = {}
+    for i, col in enumerate(original_columns):
+        target_pos.setdefault(col, []).append(i)
+    source_pos = {}
+    for j, col in enumerate(complete_df.columns):
+        source_pos.setdefault(col, []).append(j)
+    for col, targets in target_pos.items():
+        sources = source_pos.get(col)
+        if not sources:
+            continue
+        for k, i in enumerate(targets):
+            j = sources[min(k, len(sources) - 1)]
+            cvals[:n_src_rows, i] = complete_df.iloc[:, j].to_numpy(copy=False)[:n_src_rows]
+
+    # Fill only where blank is NA, using positional alignment on the raw
+    # arrays: one mask, one np.where, no intermediate DataFrames
+    mask = pd.isna(bvals)
+    out = np.where(mask, cvals, bvals)
 
-    # Work on positional copies (ignore original index labels during fill)
-    b_pos = blank_df.reset_index(drop=True)
-    c_pos = complete_df.reset_index(drop=True)
+    # Restore original index and columns exactly; re-narrow dtypes since
+    # np.where hands back an object array
+    filled_df = pd.DataFrame(out, columns=original_columns,
+                             index=original_index).convert_dtypes()
 
-    # Ensure columns match: keep only blank_df's columns, preserve order.
-    # Missing columns in complete_df become NaN and simply won't fill anything.
-    c_pos = c_pos.reindex(columns=original_columns)
+    # Count how many cells were filled (only NA slots with a source value)
+    filled_count = int(np.count_nonzero(mask & ~pd.isna(cvals)))
 
-    # Ensure same number of rows as blank_df: trim extra, pad missing with NaN
-    c_pos = c_pos.reindex(range(original_rows))
+    return filled_df, filled_count
 
-    # Fill only where blank is NA, using positional alignment
-    filled_pos = b_pos.where(~b_pos.isna(), c_pos)
+# Fixed OOXML container parts for fast_df_to_xlsx. Only the worksheet
+# varies between exports; everything else is boilerplate.
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
 
-    # Restore original index and columns exactly
-    filled_df = filled_pos.copy()
-    filled_df.columns = original_columns
-    filled_df.index = original_index
+_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
 
-    # Count how many cells were filled
-    filled_count = int(((b_pos.isna()) & (c_pos.notna())).sum().sum())
+_WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
 
-    # Final checks (shape must match exactly)
-    assert len(filled_df) == original_rows, f"Output must have {original_rows} rows, got {len(filled_df)}"
-    assert len(filled_df.columns) == original_cols, f"Output must have {original_cols} columns, got {len(filled_df.columns)}"
+_WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
 
-    return filled_df, filled_count
+_XML_ESCAPES = {ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;'}
+
+def _row_xml(r: int, values) -> str:
+    """Serialize one worksheet row to its <row> element."""
+    cells = []
+    for v in values:
+        if pd.isna(v):
+            cells.append('<c/>')
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            cells.append('<c><v>%s</v></c>' % v)
+        else:
+            cells.append('<c t="inlineStr"><is><t>%s</t></is></c>'
+                         % str(v).translate(_XML_ESCAPES))
+    return '<row r="%d">%s</row>' % (r, ''.join(cells))
+
+def _column_cells(col: pd.Series) -> np.ndarray:
+    """
+    Render one column to an array of <c> cell fragments.
+
+    Dispatching on the column dtype once replaces the per-cell isinstance
+    checks of _row_xml with a handful of vectorized string passes.
+    """
+    mask = col.isna().to_numpy()
+    if pd.api.types.is_numeric_dtype(col.dtype) and not pd.api.types.is_bool_dtype(col.dtype):
+        strs = col.to_numpy(dtype=object).astype(str)
+        cells = np.char.add(np.char.add('<c><v>', strs), '</v></c>')
+    else:
+        if pd.api.types.is_datetime64_any_dtype(col.dtype):
+            strs = col.dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+        else:
+            strs = col.astype(str).str.translate(_XML_ESCAPES)
+        cells = ('<c t="inlineStr"><is><t>' + strs + '</t></is></c>').to_numpy(dtype=str)
+    cells[mask] = '<c/>'
+    return cells
+
+def fast_df_to_xlsx(df: pd.DataFrame, sheet_name: str = 'Filled_Data') -> bytes:
+    """
+    Serialize a DataFrame to .xlsx bytes by emitting the OOXML parts
+    directly into a zip container.
+
+    This app only exports plain values (no styles or formulas), so the
+    workbook reduces to a handful of fixed XML parts plus one worksheet:
+    numbers become <v> cells and everything else inline strings. Skipping
+    openpyxl's per-cell machinery leaves string escaping and the zip write
+    as the only costs.
+    """
+    rows = [_row_xml(1, df.columns)]
+    if len(df.columns) and len(df):
+        # One vectorized pass per column, then stitch rows from the
+        # resulting 2-D array of cell fragments.
+        cells = np.column_stack([_column_cells(df.iloc[:, i])
+                                 for i in range(len(df.columns))])
+        rows.extend('<row r="%d">%s</row>' % (r, ''.join(row_cells))
+                    for r, row_cells in enumerate(cells, start=2))
+    sheet_xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<sheetData>%s</sheetData></worksheet>' % ''.join(rows)
+    )
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _CONTENT_TYPES_XML)
+        zf.writestr('_rels/.rels', _RELS_XML)
+        zf.writestr('xl/workbook.xml', _WORKBOOK_XML % sheet_name)
+        zf.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS_XML)
+        zf.writestr('xl/worksheets/sheet1.xml', sheet_xml)
+    return buf.getvalue()
 
+@st.cache_data(show_spinner=False)
 def create_download_link(df: pd.DataFrame, filename: str) -> bytes:
     """
     Create a downloadable Excel file from DataFrame.
+
+    Cached on the frame contents: st.download_button needs the bytes on
+    every rerun, but only the first rerun per result pays for the
+    serialization; preview/scroll interactions hit the cache.
     """
-    # Use a temporary file approach that's compatible with current pandas version
-    import tempfile
-    import os
-    
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp_file:
-        temp_path = tmp_file.name
-    
-    try:
-        # Write to temporary file
-        df.to_excel(temp_path, index=False, sheet_name='Filled_Data', engine='openpyxl')
-        
-        # Read the file back as bytes
-        with open(temp_path, 'rb') as f:
-            excel_data = f.read()
-        
-        return excel_data
-    
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+    return fast_df_to_xlsx(df)
 
 def main():
     st.set_page_config(
@@ -147,51 +361,79 @@ def main():
         if not validate_file_size(complete_file) or not validate_file_size(blank_file):
             return
         
+        # Only build the progress UI the first time this pair of uploads is
+        # processed; on later reruns the cached results return instantly and
+        # the widget churn would just slow the script down.
+        run_key = (
+            getattr(complete_file, 'file_id', None) or (complete_file.name, complete_file.size),
+            getattr(blank_file, 'file_id', None) or (blank_file.name, blank_file.size),
+        )
+        first_run = st.session_state.get('processed_key') != run_key
+
         try:
-            # Show progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            status_text.text("Loading complete dataset...")
-            progress_bar.progress(25)
-            complete_df = load_excel_file(complete_file)
-            if complete_df is None:
+            progress_bar = None
+            status_text = None
+            if first_run:
+                progress_bar = st.progress(0)
+                status_text = st.empty()
+                status_text.text("Loading datasets...")
+                progress_bar.progress(25)
+            # Parse both uploads concurrently: calamine (and lxml in the
+            # fallback) release the GIL during the parse, so the two loads
+            # overlap on multi-core machines.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                future_complete = executor.submit(
+                    load_excel_file, _upload_bytes(complete_file), complete_file.name)
+                future_blank = executor.submit(
+                    load_excel_file, _upload_bytes(blank_file), blank_file.name)
+                complete_df, complete_error = future_complete.result()
+                blank_df, blank_error = future_blank.result()
+            # Render load errors here: the worker threads can't draw
+            for error in (complete_error, blank_error):
+                if error:
+                    st.error(error)
+            if complete_df is None or blank_df is None:
                 return
-            
-            status_text.text("Loading dataset with blanks...")
-            progress_bar.progress(50)
-            blank_df = load_excel_file(blank_file)
-            if blank_df is None:
-                return
-            
-            status_text.text("Processing and filling missing data...")
-            progress_bar.progress(75)
-            
+
+            if first_run:
+                progress_bar.progress(50)
+                status_text.text("Processing and filling missing data...")
+                progress_bar.progress(75)
+
             # Fill missing data (STRICT positional, exact row count of blank file)
             filled_df, filled_count = fill_missing_data(complete_df, blank_df)
-            
-            progress_bar.progress(100)
-            status_text.text("Processing complete!")
-            
+
+            if first_run:
+                progress_bar.progress(100)
+                status_text.text("Processing complete!")
+            st.session_state['processed_key'] = run_key
+
             # Display results
             st.success(f"✅ Successfully filled {filled_count} missing cells!")
             
             # Create tabs for data preview
             tab1, tab2, tab3 = st.tabs(["📋 Complete Dataset", "📝 Original with Blanks", "✅ Filled Result"])
             
+            # Preview only the head of each frame: sending a full 50 MB
+            # frame over the websocket costs far more than parsing it.
+            preview_rows = 200
+
             with tab1:
                 st.subheader("Complete Dataset Preview")
-                st.dataframe(complete_df, use_container_width=True)
+                st.dataframe(complete_df.head(preview_rows), use_container_width=True)
+                st.caption(f"Showing first {min(preview_rows, len(complete_df)):,} of {len(complete_df):,} rows")
                 st.info(f"Shape: {complete_df.shape[0]} rows × {complete_df.shape[1]} columns")
-            
+
             with tab2:
                 st.subheader("Original Dataset with Blanks")
-                st.dataframe(blank_df, use_container_width=True)
+                st.dataframe(blank_df.head(preview_rows), use_container_width=True)
+                st.caption(f"Showing first {min(preview_rows, len(blank_df)):,} of {len(blank_df):,} rows")
                 st.info(f"Shape: {blank_df.shape[0]} rows × {blank_df.shape[1]} columns")
-            
+
             with tab3:
                 st.subheader("Filled Dataset")
-                st.dataframe(filled_df, use_container_width=True)
+                st.dataframe(filled_df.head(preview_rows), use_container_width=True)
+                st.caption(f"Showing first {min(preview_rows, len(filled_df)):,} of {len(filled_df):,} rows")
                 st.info(f"Shape: {filled_df.shape[0]} rows × {filled_df.shape[1]} columns")
                 
                 # Download button
@@ -208,9 +450,10 @@ def main():
                     st.info("No missing data was found to fill.")
             
             # Clear progress indicators
-            progress_bar.empty()
-            status_text.empty()
-            
+            if first_run:
+                progress_bar.empty()
+                status_text.empty()
+
         except Exception as e:
             st.error(f"An error occurred during processing: {str(e)}")
             st.error("Please check your files and try again.")